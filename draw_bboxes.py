@@ -16,28 +16,46 @@ Example:
     -output_path "output_image.png"
 """
 
-from PIL import Image, ImageDraw
+from PIL import Image, ImageColor
+import numpy as np
 import argparse
 
-def draw_bounding_boxes(image_path, label_path, output_path):
+def _span(start, stop):
+    # Clamp a pixel range to the image without letting negative indices wrap around
+    return slice(max(start, 0), max(stop, 0))
+
+def draw_bounding_boxes(image_path, label_path, output_path, line_width=2):
     with Image.open(image_path) as img:
-        draw = ImageDraw.Draw(img)
+        # Palette and other exotic modes can't take a colour tuple per pixel, so draw on an RGB copy
+        if img.mode not in ('L', 'RGB', 'RGBA'):
+            img = img.convert('RGB')
         width, height = img.size
+        mode = img.mode
+        pixels = np.array(img)
+    color = ImageColor.getcolor("red", mode)
+
+    # An empty or whitespace-only label file just means there is nothing to draw
+    with open(label_path, 'r') as file:
+        content = file.read()
+    if content.strip():
+        labels = np.loadtxt(content.splitlines(), ndmin=2)
+    else:
+        labels = np.empty((0, 5))
+    if labels.shape[1] < 5:
+        raise ValueError(f"Expected at least 5 columns (class x_center y_center width height) in {label_path}, "
+                         f"got {labels.shape[1]}")
+    # Any extra columns, such as a detection confidence, are ignored
+    x_center, y_center, w, h = (labels[:, 1:5] * [width, height, width, height]).T
+    boxes = np.column_stack((x_center - w / 2, y_center - h / 2, x_center + w / 2, y_center + h / 2))
+
+    # Paint the four border strips of each box straight into the pixel array
+    for left, top, right, bottom in boxes.astype(int).tolist():
+        pixels[_span(top, top + line_width), _span(left, right + 1)] = color
+        pixels[_span(bottom - line_width + 1, bottom + 1), _span(left, right + 1)] = color
+        pixels[_span(top, bottom + 1), _span(left, left + line_width)] = color
+        pixels[_span(top, bottom + 1), _span(right - line_width + 1, right + 1)] = color
 
-        with open(label_path, 'r') as file:
-            for line in file:
-                class_id, x_center, y_center, w, h = map(float, line.split())
-                x_center *= width
-                y_center *= height
-                w *= width
-                h *= height
-                left = x_center - (w / 2)
-                top = y_center - (h / 2)
-                right = x_center + (w / 2)
-                bottom = y_center + (h / 2)
-                draw.rectangle([left, top, right, bottom], outline="red", width=2)
-
-        img.save(output_path)
+    Image.fromarray(pixels, mode).save(output_path)
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Draw bounding boxes on images based on YOLO format annotations.')
@@ -18,19 +18,25 @@ Example:
 
 import os
 import geopandas as gpd
-from shapely.geometry import box
+from shapely import box
 import argparse
 
 def create_grouped_axis_aligned_bounding_boxes(shapefile_path, output_path, group_field):
     # Load the original shapefile
-    gdf = gpd.read_file(shapefile_path)
+    gdf = gpd.read_file(shapefile_path, engine="pyogrio", use_arrow=True)
 
-    # Group by the specified field and create a bounding box for each group
-    grouped = gdf.dissolve(by=group_field)
-    grouped['geometry'] = grouped.apply(lambda x: box(*x.geometry.bounds), axis=1)
+    # Group by the specified field and create a bounding box for each group. The bounds of a group's union
+    # are just the min/max of its members' bounds, so aggregate those instead of dissolving the geometries
+    bounds = gdf.geometry.bounds.assign(**{group_field: gdf[group_field].values})
+    extents = bounds.groupby(group_field).agg(minx=('minx', 'min'), miny=('miny', 'min'),
+                                              maxx=('maxx', 'max'), maxy=('maxy', 'max'))
+    attributes = gdf.drop(columns=gdf.geometry.name).groupby(group_field).first()
+    grouped = gpd.GeoDataFrame(attributes, geometry=box(extents['minx'].values, extents['miny'].values,
+                                                        extents['maxx'].values, extents['maxy'].values),
+                               crs=gdf.crs)
 
     # Save the new shapefile with grouped axis-aligned bounding boxes
-    grouped.reset_index().to_file(output_path, index=False)
+    grouped.reset_index().to_file(output_path, index=False, engine="pyogrio", use_arrow=True)
 
 def process_folder(input_folder, output_folder, group_field):
     # Ensure the output folder exists
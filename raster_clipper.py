@@ -3,9 +3,11 @@ raster_clipper.py
 
 Description:
     This script clips raster images based on polygons defined in a shapefile and exports the results as new TIFF files.
-    It also checks for intersections with another shapefile containing bounding boxes and exports these intersections
-    as separate shapefiles. The script is useful for extracting specific areas from large raster datasets and
-    for spatial analyses involving defined regions or bounding boxes.
+    It also checks for intersections with another shapefile containing bounding boxes and exports these intersections,
+    tagged with the square_id of the square they fall in, to a single GeoParquet file (bboxes.parquet) by default.
+    Use -bbox_format gpkg for a single GeoPackage instead, or -bbox_format shp for one shapefile per square as
+    expected by tif_shp_to_yolo_png_converter.py. The script is useful for extracting specific areas from large
+    raster datasets and for spatial analyses involving defined regions or bounding boxes.
 
 Usage:
     Run the script with the following command line arguments:
@@ -13,6 +15,7 @@ Usage:
     -squares_shp_path <path_to_polygon_shapefile>
     -bbox_shp_path <path_to_bounding_box_shapefile>
     -output_dir <path_to_output_directory>
+    -bbox_format <parquet|gpkg|shp> (optional, default: parquet)
 
 Example:
     python raster_clipper.py -raster_path "/path/to/raster.tif" -squares_shp_path "/path/to/squares.shp"
@@ -20,30 +23,39 @@ Example:
 """
 
 import geopandas as gpd
+import numpy as np
 import rasterio
-from rasterio.mask import mask
+from rasterio.errors import WindowError
+from rasterio.features import geometry_mask, geometry_window
+from shapely import STRtree, force_2d
 from shapely.geometry import mapping
 import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 def reproject_shapefile_to_match_raster(shapefile_gdf, raster_crs):
     return shapefile_gdf.to_crs(raster_crs)
 
-def make_2d(geojson):
-    if 'coordinates' in geojson:
-        geojson['coordinates'] = [[[x, y] for x, y, *_ in ring] for ring in geojson['coordinates']]
-    return geojson
+def make_2d(polygon):
+    # Source geometries are almost always 2D already; only drop Z when there is one
+    if polygon.has_z:
+        polygon = force_2d(polygon)
+    return mapping(polygon)
 
 def clip_raster_with_polygon(raster_path, polygon, output_path):
     with rasterio.open(raster_path) as src:
-        geojson_polygon = mapping(polygon)
-        geojson_polygon_2d = make_2d(geojson_polygon)
-        print("2D GeoJSON Polygon:", geojson_polygon_2d)
+        geojson_polygon_2d = make_2d(polygon)
         try:
-            out_image, out_transform = mask(src, [geojson_polygon_2d], crop=True)
-        except Exception as e:
+            window = geometry_window(src, [geojson_polygon_2d])
+        except WindowError as e:
             print(f"Error during masking: {e}")
             raise
+        # Read only the polygon's window and blank out pixels outside the polygon
+        out_transform = src.window_transform(window)
+        out_shape = (int(window.height), int(window.width))
+        out_image = src.read(window=window, out_shape=out_shape)
+        outside = geometry_mask([geojson_polygon_2d], out_shape=out_shape, transform=out_transform)
+        out_image[:, outside] = src.nodata if src.nodata is not None else 0
         out_meta = src.meta.copy()
         out_meta.update({
             "driver": "GTiff",
@@ -54,21 +66,52 @@ def clip_raster_with_polygon(raster_path, polygon, output_path):
     with rasterio.open(output_path, "w", **out_meta) as dest:
         dest.write(out_image)
 
-def main(raster_path, squares_shp_path, bbox_shp_path, output_dir):
+def _process_square(args):
+    raster_path, geom, index, output_dir = args
+    square_raster_path = os.path.join(output_dir, f"square_{index}.tif")
+    clip_raster_with_polygon(raster_path, geom, square_raster_path)
+    return index, square_raster_path
+
+def write_bboxes(intersecting_bboxes, square_ids, output_dir, bbox_format):
+    if bbox_format == 'parquet':
+        bbox_output_path = os.path.join(output_dir, "bboxes.parquet")
+        intersecting_bboxes.to_parquet(bbox_output_path)
+    elif bbox_format == 'gpkg':
+        bbox_output_path = os.path.join(output_dir, "bboxes.gpkg")
+        intersecting_bboxes.to_file(bbox_output_path, layer="bboxes", driver="GPKG", engine="pyogrio", use_arrow=True)
+    else:
+        # One shapefile per square, including empty ones, as tif_shp_to_yolo_png_converter.py expects
+        bboxes = intersecting_bboxes.drop(columns='square_id')
+        groups = dict(tuple(bboxes.groupby(intersecting_bboxes['square_id'])))
+        for square_id in square_ids:
+            square_output_path = os.path.join(output_dir, f"square_{square_id}.shp")
+            groups.get(square_id, bboxes.iloc[:0]).to_file(square_output_path, engine="pyogrio", use_arrow=True)
+        bbox_output_path = os.path.join(output_dir, "square_*.shp")
+    print(f"Saved {len(intersecting_bboxes)} intersecting bboxes to {bbox_output_path}")
+
+def main(raster_path, squares_shp_path, bbox_shp_path, output_dir, bbox_format='parquet'):
     os.makedirs(output_dir, exist_ok=True)
     with rasterio.open(raster_path) as src:
         raster_crs = src.crs
-    squares_gdf = gpd.read_file(squares_shp_path)
+    squares_gdf = gpd.read_file(squares_shp_path, engine="pyogrio", use_arrow=True)
     squares_gdf = reproject_shapefile_to_match_raster(squares_gdf, raster_crs)
-    bbox_gdf = gpd.read_file(bbox_shp_path)
+    bbox_gdf = gpd.read_file(bbox_shp_path, engine="pyogrio", use_arrow=True)
     bbox_gdf = reproject_shapefile_to_match_raster(bbox_gdf, raster_crs)
-    for index, square in squares_gdf.iterrows():
-        square_raster_path = os.path.join(output_dir, f"square_{index}.tif")
-        clip_raster_with_polygon(raster_path, square.geometry, square_raster_path)
-        intersecting_bboxes = bbox_gdf[bbox_gdf.intersects(square.geometry)]
-        bbox_output_path = os.path.join(output_dir, f"square_{index}.shp")
-        intersecting_bboxes.to_file(bbox_output_path)
-        print(f"Processed square {index}: {square_raster_path}, {bbox_output_path}")
+
+    # Pair every square with its intersecting bboxes in one bulk tree query
+    tree = STRtree(bbox_gdf.geometry.values)
+    square_idx, bbox_idx = tree.query(squares_gdf.geometry.values, predicate='intersects')
+    # Tree order is arbitrary; keep each square's bboxes in source order
+    order = np.lexsort((bbox_idx, square_idx))
+    square_idx, bbox_idx = square_idx[order], bbox_idx[order]
+    intersecting_bboxes = bbox_gdf.iloc[bbox_idx].assign(square_id=squares_gdf.index[square_idx])
+    write_bboxes(intersecting_bboxes, squares_gdf.index, output_dir, bbox_format)
+
+    tasks = [(raster_path, square.geometry, index, output_dir) for index, square in squares_gdf.iterrows()]
+    # Each worker opens its own raster handle; GDAL datasets must not be shared across processes
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for index, square_raster_path in executor.map(_process_square, tasks):
+            print(f"Processed square {index}: {square_raster_path}")
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Clip rasters with polygons and handle bounding boxes.')
@@ -76,8 +119,10 @@ def parse_arguments():
     parser.add_argument('-squares_shp_path', type=str, required=True, help='Path to the polygon shapefile for clipping.')
     parser.add_argument('-bbox_shp_path', type=str, required=True, help='Path to the bounding box shapefile.')
     parser.add_argument('-output_dir', type=str, required=True, help='Path to save the output files.')
+    parser.add_argument('-bbox_format', type=str, choices=['parquet', 'gpkg', 'shp'], default='parquet',
+                        help='Output format for the intersecting bounding boxes.')
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_arguments()
-    main(args.raster_path, args.squares_shp_path, args.bbox_shp_path, args.output_dir)
+    main(args.raster_path, args.squares_shp_path, args.bbox_shp_path, args.output_dir, args.bbox_format)
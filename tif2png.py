@@ -10,6 +10,7 @@ Usage:
     Run the script with the following command line arguments:
     -input_folder <path_to_input_folder_with_tiff_files>
     -output_folder <path_to_output_folder_for_png_files>
+    -device <cpu|cuda> (optional, default: cpu; cuda stretches bands over 100 MB on the GPU and requires CuPy)
 
 Example:
     python tif2png.py -input_folder "Predict" -output_folder "PredictPNG"
@@ -20,57 +21,127 @@ import os
 import rasterio
 from PIL import Image
 import numpy as np
+import numba
 import argparse
-
-def convert_tif_to_png(tif_path, png_path):
+from concurrent.futures import ProcessPoolExecutor
+
+def compute_percentiles(band, low=2, high=98, sample_step=64):
+    if band.dtype in (np.uint8, np.uint16):
+        # uint8/uint16 bands: exact percentiles from the value histogram, no sort needed
+        cdf = np.cumsum(np.bincount(band.ravel()))
+        return np.searchsorted(cdf, np.array([low, high]) / 100 * cdf[-1])
+
+    # Float bands: estimate percentiles from a strided sample of the valid pixels
+    sample = band.ravel()[::sample_step]
+    sample = sample[sample > -3.40282e+38]
+    if sample.size == 0:
+        sample = band[band > -3.40282e+38]
+    return np.percentile(sample, (low, high))
+
+@numba.njit(parallel=True, cache=True)
+def scale_band(band, p2, p98, out):
+    # Clip, rescale to 0-255 and zero out invalid pixels in a single pass over the band
+    # A flat band (p2 == p98) has no range to stretch, so its valid pixels map to 0
+    scale = 255.0 / (p98 - p2) if p98 > p2 else 0.0
+    for row in numba.prange(band.shape[0]):
+        for col in range(band.shape[1]):
+            value = float(band[row, col])
+            if value > -3.40282e+38:
+                out[row, col] = np.uint8((min(max(value, p2), p98) - p2) * scale)
+            else:
+                out[row, col] = 0
+
+# Bands smaller than this are stretched on the CPU; the host/device copies outweigh the GPU speedup
+CUDA_MIN_BAND_BYTES = 100 * 1024 * 1024
+
+def scale_band_cuda(band, out, low=2, high=98):
+    # Imported lazily so CuPy is only required when -device cuda is used
+    import cupy as cp
+
+    gpu_band = cp.asarray(band)
+    valid_mask = gpu_band > -3.40282e+38
+    if not bool(valid_mask.any()):
+        return False
+
+    if band.dtype in (np.uint8, np.uint16):
+        cdf = cp.cumsum(cp.bincount(gpu_band.ravel()))
+        p2, p98 = cp.searchsorted(cdf, cp.array([low, high]) / 100 * cdf[-1]).get()
+    else:
+        p2, p98 = cp.percentile(gpu_band[valid_mask], (low, high)).get()
+
+    scaled = cp.clip(gpu_band.astype(cp.float32), p2, p98)
+    # A flat band (p2 == p98) has no range to stretch, so its valid pixels map to 0
+    scale = 255.0 / (p98 - p2) if p98 > p2 else 0.0
+    scaled = ((scaled - p2) * scale).astype(cp.uint8)
+    scaled[~valid_mask] = 0
+    out[...] = scaled.get()
+    return True
+
+def convert_tif_to_png(tif_path, png_path, device='cpu'):
     with rasterio.open(tif_path) as src:
-        bands = [src.read(i) for i in (1, 2, 3)]
-        scaled_bands = []
-
-        for band in bands:
-            band = band.astype('float32')
-
-            # Mask out the placeholder/error values typically used in geospatial rasters
-            valid_mask = band > -3.40282e+38
+        # Read all three bands in one call, keeping the native dtype for the percentile histogram
+        bands = src.read((1, 2, 3))
+        # Scaled bands are written straight into one interleaved RGB buffer
+        array = np.zeros((src.height, src.width, 3), dtype=np.uint8)
+        has_valid_data = False
+
+        for i, band in enumerate(bands):
+            if device == 'cuda' and band.nbytes > CUDA_MIN_BAND_BYTES:
+                has_valid_data |= scale_band_cuda(band, array[..., i])
+                continue
 
-            # Calculate percentiles only on valid data
-            if np.any(valid_mask):
-                p2, p98 = np.percentile(band[valid_mask], (2, 98))
+            # Calculate percentiles only on valid data, skipping the placeholder/error values
+            # typically used in geospatial rasters
+            if np.any(band > -3.40282e+38):
+                p2, p98 = compute_percentiles(band)
             else:
-                # If no valid data, skip scaling
+                # If no valid data, leave the band black
                 continue
 
-            band = np.clip(band, p2, p98)
-            band = (band - p2) / (p98 - p2) * 255
+            # Scale to uint8, setting invalid areas to 0 (black)
+            scale_band(band, float(p2), float(p98), array[..., i])
+            has_valid_data = True
 
-            # Apply the mask to set invalid areas to 0 (black)
-            band[~valid_mask] = 0
-
-            scaled_bands.append(band)
-
-        if scaled_bands:  # Check if we have any bands to process
-            array = np.dstack(scaled_bands).astype(np.uint8)
+        if has_valid_data:  # Check if we had any bands to process
             image = Image.fromarray(array, 'RGB')
             image.save(png_path)
 
-def main(input_folder, output_folder):
+def _init_worker():
+    # Files are already spread across processes, so keep scale_band to one thread per worker
+    numba.set_num_threads(1)
+
+def _convert_one(args):
+    tif_file, png_file, device = args
+    convert_tif_to_png(tif_file, png_file, device)
+    return tif_file, png_file
+
+def main(input_folder, output_folder, device='cpu'):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
     tif_files = glob.glob(os.path.join(input_folder, '*.tif'))
-
-    for tif_file in tif_files:
-        png_file = os.path.join(output_folder, os.path.basename(tif_file).replace('.tif', '.png'))
-        print(f'Converting {tif_file} to {png_file}')
-        convert_tif_to_png(tif_file, png_file)
+    tasks = [(tif_file, os.path.join(output_folder, os.path.basename(tif_file).replace('.tif', '.png')), device)
+             for tif_file in tif_files]
+
+    # Each TIFF is independent, so convert them in parallel. GPU runs stay in a single worker so only one
+    # CUDA context holds bands in VRAM at a time; that worker keeps all Numba threads for its CPU bands
+    if device == 'cuda':
+        max_workers, initializer = 1, None
+    else:
+        max_workers, initializer = os.cpu_count(), _init_worker
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=initializer) as executor:
+        for tif_file, png_file in executor.map(_convert_one, tasks):
+            print(f'Converted {tif_file} to {png_file}')
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Convert TIFF images to PNG format.')
     parser.add_argument('-input_folder', type=str, required=True, help='Directory containing TIFF files.')
     parser.add_argument('-output_folder', type=str, required=True, help='Directory to save PNG files.')
+    parser.add_argument('-device', type=str, choices=['cpu', 'cuda'], default='cpu',
+                        help='Device used to stretch large bands (cuda requires CuPy).')
 
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_arguments()
-    main(args.input_folder, args.output_folder)
+    main(args.input_folder, args.output_folder, args.device)
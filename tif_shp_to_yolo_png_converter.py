@@ -23,13 +23,13 @@ import rasterio
 from PIL import Image
 import numpy as np
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 def convert_tif_to_png(tif_path, png_path):
     with rasterio.open(tif_path) as src:
-        bands = [src.read(i) for i in (1, 2, 3)]
+        bands = src.read((1, 2, 3), out_dtype='float32')
         scaled_bands = []
         for band in bands:
-            band = band.astype('float32')
             p2, p98 = np.percentile(band, (2, 98))
             band = np.clip(band, p2, p98)
             band = (band - p2) / (p98 - p2) * 255
@@ -38,36 +38,45 @@ def convert_tif_to_png(tif_path, png_path):
         image = Image.fromarray(array, 'RGB')
         image.save(png_path)
 
-def convert_geo_to_pixel_coords(geo_coords, transform):
-    minx, miny, maxx, maxy = geo_coords
-    px_minx, px_miny = ~transform * (minx, miny)
-    px_maxx, px_maxy = ~transform * (maxx, maxy)
-    return px_minx, px_maxy, px_maxx, px_miny
+def convert_geo_to_pixel_coords(geo_bounds, transform):
+    # geo_bounds is an (N, 4) array of [minx, miny, maxx, maxy]; both corners of every box
+    # go through the inverse affine as one (2N, 2) matrix multiply
+    inv = ~transform
+    linear = np.array([[inv.a, inv.b], [inv.d, inv.e]])
+    offset = np.array([inv.c, inv.f])
+    pixels = (geo_bounds.reshape(-1, 2) @ linear.T + offset).reshape(-1, 4)
+    # Pixel rows grow downwards, so the geographic maxy corner gives the smallest row
+    return pixels[:, 0], pixels[:, 3], pixels[:, 2], pixels[:, 1]
 
 def shp_to_yolo(tif_path, shp_path, yolo_path):
-    gdf = gpd.read_file(shp_path)
+    gdf = gpd.read_file(shp_path, engine="pyogrio", use_arrow=True)
     with rasterio.open(tif_path) as src:
         transform = src.transform
         img_width, img_height = src.width, src.height
+    geo_bounds = gdf.geometry.bounds.to_numpy()
+    px_minx, px_miny, px_maxx, px_maxy = convert_geo_to_pixel_coords(geo_bounds, transform)
+    x_center_norm = (px_minx + px_maxx) / 2.0 / img_width
+    y_center_norm = (px_miny + px_maxy) / 2.0 / img_height
+    width_norm = (px_maxx - px_minx) / img_width
+    height_norm = (px_maxy - px_miny) / img_height
+    labels = np.column_stack((x_center_norm, y_center_norm, width_norm, height_norm))
+    # Format every label up front and write the file in a single call
+    # (np.savetxt would still issue one write per row)
     with open(yolo_path, 'w') as file:
-        for _, row in gdf.iterrows():
-            geo_bounds = row['geometry'].bounds
-            px_minx, px_miny, px_maxx, px_maxy = convert_geo_to_pixel_coords(geo_bounds, transform)
-            x_center = (px_minx + px_maxx) / 2.0
-            y_center = (px_miny + px_maxy) / 2.0
-            width = px_maxx - px_minx
-            height = px_maxy - px_miny
-            x_center_norm = x_center / img_width
-            y_center_norm = y_center / img_height
-            width_norm = width / img_width
-            height_norm = height / img_height
-            file.write(f"0 {x_center_norm} {y_center_norm} {width_norm} {height_norm}\n")
+        file.write(''.join(f"0 {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n" for x, y, w, h in labels.tolist()))
+
+def _convert_one(args):
+    tif_path, shp_path, png_path, yolo_path = args
+    convert_tif_to_png(tif_path, png_path)
+    shp_to_yolo(tif_path, shp_path, yolo_path)
+    return png_path, yolo_path
 
 def main(tif_dir, shp_dir, output_base_dir):
     output_png_dir = os.path.join(output_base_dir, 'images')
     output_txt_dir = os.path.join(output_base_dir, 'labels')
     os.makedirs(output_png_dir, exist_ok=True)
     os.makedirs(output_txt_dir, exist_ok=True)
+    tasks = []
     for filename in os.listdir(tif_dir):
         if filename.endswith('.tif'):
             base_name = os.path.splitext(filename)[0]
@@ -75,8 +84,9 @@ def main(tif_dir, shp_dir, output_base_dir):
             shp_path = os.path.join(shp_dir, f"{base_name}.shp")
             png_path = os.path.join(output_png_dir, f"{base_name}.png")
             yolo_path = os.path.join(output_txt_dir, f"{base_name}.txt")
-            convert_tif_to_png(tif_path, png_path)
-            shp_to_yolo(tif_path, shp_path, yolo_path)
+            tasks.append((tif_path, shp_path, png_path, yolo_path))
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for png_path, yolo_path in executor.map(_convert_one, tasks):
             print(f"Processed and saved: {png_path}, {yolo_path}")
 
 def parse_arguments():
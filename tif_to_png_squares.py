@@ -2,92 +2,122 @@
 tif_to_png_squares.py
 
 Description:
-    Converts geospatial TIFF images to PNG format and then splits these PNG images into smaller square segments.
+    Converts geospatial TIFF images into smaller square PNG segments. Each TIFF is read in windows, one row of
+    squares at a time, so the full image is never converted or held in memory at once.
     This process is useful for preparing data for machine learning tasks, especially in computer vision, by
     creating manageable, uniform image sizes from large geospatial datasets.
 
 Usage:
     Run the script with the following command line arguments:
     -input_folder <path_to_input_folder_with_tiff_files>
-    -temp_output_folder <temporary_path_for_storing_png_files>
     -final_output_folder <path_for_storing_square_segments>
     -square_size <size_of_each_square_in_pixels>
 
 Example:
-    python tif_to_png_squares.py -input_folder "Predict" -temp_output_folder "PredictPNG"
-    -final_output_folder "PredictPNGSquares" -square_size 200
+    python tif_to_png_squares.py -input_folder "Predict" -final_output_folder "PredictPNGSquares" -square_size 200
 """
 
 import glob
 import os
 import rasterio
+from rasterio.windows import Window
 from PIL import Image
 import numpy as np
+import numba
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-def convert_tif_to_png(tif_path, png_path):
-    with rasterio.open(tif_path) as src:
-        bands = [src.read(i) for i in (1, 2, 3)]
-        scaled_bands = []
-
-        for band in bands:
-            band = band.astype('float32')
-            valid_mask = band > -3.40282e+38
-            if np.any(valid_mask):
-                p2, p98 = np.percentile(band[valid_mask], (2, 98))
+def compute_percentiles(src, indexes, strip_height, low=2, high=98, sample_step=64):
+    # Accumulate over horizontal strips so the full bands are never held in memory
+    hists = [None] * len(indexes)
+    samples = [[] for _ in indexes]
+    for row_off in range(0, src.height, strip_height):
+        window = Window(0, row_off, src.width, min(strip_height, src.height - row_off))
+        strip = src.read(indexes, window=window)
+        for i, band in enumerate(strip):
+            if band.dtype in (np.uint8, np.uint16):
+                # uint8/uint16 bands: exact percentiles from the value histogram, no sort needed
+                counts = np.bincount(band.ravel(), minlength=np.iinfo(band.dtype).max + 1)
+                hists[i] = counts if hists[i] is None else hists[i] + counts
             else:
-                continue
-            band = np.clip(band, p2, p98)
-            band = (band - p2) / (p98 - p2) * 255
-            band[~valid_mask] = 0
-            scaled_bands.append(band)
-
-        if scaled_bands:
-            array = np.dstack(scaled_bands).astype(np.uint8)
-            image = Image.fromarray(array, 'RGB')
-            image.save(png_path)
-
-def split_png_to_squares(png_path, output_folder, square_size):
-    image = Image.open(png_path)
-    width, height = image.size
-    num_rows = height // square_size
-    num_cols = width // square_size
-
-    base_name = os.path.splitext(os.path.basename(png_path))[0]
+                # Float bands: estimate percentiles from a strided sample of the valid pixels
+                valid = band[band > -3.40282e+38]
+                samples[i].append(valid[::sample_step])
+
+    percentiles = []
+    for hist, band_samples in zip(hists, samples):
+        if hist is not None:
+            cdf = np.cumsum(hist)
+            percentiles.append(np.searchsorted(cdf, np.array([low, high]) / 100 * cdf[-1]))
+            continue
+        sample = np.concatenate(band_samples)
+        percentiles.append(np.percentile(sample, (low, high)) if sample.size else None)
+    return percentiles
+
+@numba.njit(parallel=True, cache=True)
+def scale_band(band, p2, p98, out):
+    # Clip, rescale to 0-255 and zero out invalid pixels in a single pass over the band
+    # A flat band (p2 == p98) has no range to stretch, so its valid pixels map to 0
+    scale = 255.0 / (p98 - p2) if p98 > p2 else 0.0
+    for row in numba.prange(band.shape[0]):
+        for col in range(band.shape[1]):
+            value = float(band[row, col])
+            if value > -3.40282e+38:
+                out[row, col] = np.uint8((min(max(value, p2), p98) - p2) * scale)
+            else:
+                out[row, col] = 0
+
+def convert_tif_to_squares(tif_path, output_folder, square_size):
+    base_name = os.path.splitext(os.path.basename(tif_path))[0]
     squares_output_folder = os.path.join(output_folder, base_name)
     os.makedirs(squares_output_folder, exist_ok=True)
 
-    for y in range(num_rows):
-        for x in range(num_cols):
-            left = x * square_size
-            upper = y * square_size
-            right = (x + 1) * square_size
-            lower = (y + 1) * square_size
-            square = image.crop((left, upper, right, lower))
-            square.save(os.path.join(squares_output_folder, f"square_{y}_{x}.png"))
+    with rasterio.open(tif_path) as src:
+        num_rows = src.height // square_size
+        num_cols = src.width // square_size
+        percentiles = compute_percentiles(src, (1, 2, 3), square_size)
+
+        # Read one row of squares at a time and scale it straight to uint8
+        for y in range(num_rows):
+            window = Window(0, y * square_size, num_cols * square_size, square_size)
+            strip = src.read((1, 2, 3), window=window)
+            scaled = np.zeros((square_size, num_cols * square_size, 3), dtype=np.uint8)
+            for i, band_percentiles in enumerate(percentiles):
+                # Bands without valid data stay black
+                if band_percentiles is not None:
+                    p2, p98 = band_percentiles
+                    scale_band(strip[i], float(p2), float(p98), scaled[..., i])
+
+            for x in range(num_cols):
+                square = scaled[:, x * square_size:(x + 1) * square_size]
+                Image.fromarray(square, 'RGB').save(os.path.join(squares_output_folder, f"square_{y}_{x}.png"))
+
+def _init_worker():
+    # Files are already spread across processes, so keep scale_band to one thread per worker
+    numba.set_num_threads(1)
+
+def _convert_one(args):
+    tif_file, output_folder, square_size = args
+    convert_tif_to_squares(tif_file, output_folder, square_size)
+    return tif_file
 
-def main(input_folder, temp_output_folder, final_output_folder, square_size):
-    os.makedirs(temp_output_folder, exist_ok=True)
-    os.makedirs(final_output_folder, exist_ok=True)
+def main(input_folder, output_folder, square_size):
+    os.makedirs(output_folder, exist_ok=True)
 
     tif_files = glob.glob(os.path.join(input_folder, '*.tif'))
+    tasks = [(tif_file, output_folder, square_size) for tif_file in tif_files]
 
-    for tif_file in tif_files:
-        base_name = os.path.basename(tif_file)
-        png_path = os.path.join(temp_output_folder, base_name.replace('.tif', '.png'))
-        print(f'Converting {tif_file} to {png_path}')
-        convert_tif_to_png(tif_file, png_path)
-        print(f'Splitting {png_path} into squares')
-        split_png_to_squares(png_path, final_output_folder, square_size)
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker) as executor:
+        for tif_file in executor.map(_convert_one, tasks):
+            print(f'Split {tif_file} into squares')
 
 def parse_arguments():
-    parser = argparse.ArgumentParser(description='Convert TIFF images to PNG and split into squares for ML training.')
+    parser = argparse.ArgumentParser(description='Convert TIFF images into square PNG segments for ML training.')
     parser.add_argument('-input_folder', type=str, required=True, help='Directory containing TIFF files.')
-    parser.add_argument('-temp_output_folder', type=str, required=True, help='Temporary directory for PNG files.')
     parser.add_argument('-final_output_folder', type=str, required=True, help='Directory to store final square segments.')
     parser.add_argument('-square_size', type=int, required=True, help='Size of each square segment in pixels.')
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_arguments()
-    main(args.input_folder, args.temp_output_folder, args.final_output_folder, args.square_size)
+    main(args.input_folder, args.final_output_folder, args.square_size)
@@ -19,48 +19,59 @@ Example:
 import os
 import geopandas as gpd
 import rasterio
-from shapely.geometry import box
+from shapely import box
 import pandas as pd
+import numpy as np
 from pathlib import Path
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
-def detections_to_shp(tif_path, detections_path, output_path):
+def read_tif_metadata(tif_path):
     with rasterio.open(tif_path) as src:
-        transform = src.transform
-        crs = src.crs
+        return src.transform, src.crs, src.width, src.height
 
+def detections_to_shp(detections_path, output_path, transform, crs, img_width, img_height):
     detections = pd.read_csv(detections_path, sep=' ', header=None,
                              names=['class_id', 'x_center', 'y_center', 'width', 'height'])
 
-    geoms = []
-    for _, row in detections.iterrows():
-        x_center, y_center, width, height = row['x_center'], row['y_center'], row['width'], row['height']
-        x1 = (x_center - width / 2) * src.width
-        y1 = (y_center - height / 2) * src.height
-        x2 = (x_center + width / 2) * src.width
-        y2 = (y_center + height / 2) * src.height
-        top_left = transform * (x1, y1)
-        bottom_right = transform * (x2, y2)
-        geom = box(top_left[0], bottom_right[1], bottom_right[0], top_left[1])
-        geoms.append(geom)
+    x_center, y_center, width, height = detections[['x_center', 'y_center', 'width', 'height']].to_numpy(dtype=float).T
+    x1 = (x_center - width / 2) * img_width
+    y1 = (y_center - height / 2) * img_height
+    x2 = (x_center + width / 2) * img_width
+    y2 = (y_center + height / 2) * img_height
+    # Apply the affine to both corners of every box as one (2N, 2) matrix multiply
+    linear = np.array([[transform.a, transform.b], [transform.d, transform.e]])
+    offset = np.array([transform.c, transform.f])
+    corners = np.column_stack((x1, y1, x2, y2)).reshape(-1, 2)
+    left, top, right, bottom = (corners @ linear.T + offset).reshape(-1, 4).T
+    geoms = box(left, bottom, right, top)
 
-    gdf = gpd.GeoDataFrame({'geometry': geoms, 'class_id': detections['class_id']})
-    gdf.crs = crs
-    gdf.to_file(output_path)
+    gdf = gpd.GeoDataFrame({'class_id': detections['class_id'].values, 'geometry': geoms}, crs=crs)
+    gdf.to_file(output_path, engine="pyogrio", use_arrow=True)
 
 def process_directory(tif_dir, detections_dir, output_dir):
     Path(output_dir).mkdir(parents=True, exist_ok=True)
-    for detection_file in os.listdir(detections_dir):
-        if detection_file.endswith('.txt'):
-            base_name = os.path.splitext(detection_file)[0]
-            tif_path = os.path.join(tif_dir, f"{base_name}.tif")
-            detections_path = os.path.join(detections_dir, detection_file)
-            output_path = os.path.join(output_dir, f"{base_name}.shp")
-            if os.path.exists(tif_path):
-                print(f"Processing {base_name}")
-                detections_to_shp(tif_path, detections_path, output_path)
-            else:
-                print(f"Warning: No matching TIF file found for {detection_file}")
+    detection_files = [f for f in os.listdir(detections_dir) if f.endswith('.txt')]
+
+    # Read the georeferencing of every matching TIF once, up front
+    tif_paths = {}
+    for detection_file in detection_files:
+        base_name = os.path.splitext(detection_file)[0]
+        tif_path = os.path.join(tif_dir, f"{base_name}.tif")
+        if os.path.exists(tif_path):
+            tif_paths[base_name] = tif_path
+    with ThreadPoolExecutor() as executor:
+        tif_metadata = dict(zip(tif_paths, executor.map(read_tif_metadata, tif_paths.values())))
+
+    for detection_file in detection_files:
+        base_name = os.path.splitext(detection_file)[0]
+        detections_path = os.path.join(detections_dir, detection_file)
+        output_path = os.path.join(output_dir, f"{base_name}.shp")
+        if base_name in tif_metadata:
+            print(f"Processing {base_name}")
+            detections_to_shp(detections_path, output_path, *tif_metadata[base_name])
+        else:
+            print(f"Warning: No matching TIF file found for {detection_file}")
 
 def main():
     parser = argparse.ArgumentParser(description='Convert YOLO detection outputs to Shapefiles.')